@@ -208,6 +208,10 @@ def load_rules(filename, use_rule=None):
         raise EAException('%s must contain %s' % (filename, ', '.join(required_globals - frozenset(conf.keys()))))
 
     conf.setdefault('max_query_size', 100000)
+    conf.setdefault('scroll_size', 1000)
+    conf.setdefault('scroll_keepalive', '30s')
+    conf.setdefault('writeback_flush_size', 500)
+    conf.setdefault('rule_concurrency', 8)
 
     # Convert run_every, buffer_time into a timedelta object
     try:
@@ -221,6 +225,14 @@ def load_rules(filename, use_rule=None):
             conf['old_query_limit'] = datetime.timedelta(**conf['old_query_limit'])
         else:
             conf['old_query_limit'] = datetime.timedelta(weeks=1)
+        if 'writeback_flush_interval' in conf:
+            conf['writeback_flush_interval'] = datetime.timedelta(**conf['writeback_flush_interval'])
+        else:
+            conf['writeback_flush_interval'] = datetime.timedelta(seconds=1)
+        if 'silence_cache_ttl' in conf:
+            conf['silence_cache_ttl'] = datetime.timedelta(**conf['silence_cache_ttl'])
+        else:
+            conf['silence_cache_ttl'] = datetime.timedelta(seconds=60)
     except (KeyError, TypeError) as e:
         raise EAException('Invalid time format used: %s' % (e))
 
@@ -250,13 +262,26 @@ def load_rules(filename, use_rule=None):
     return conf
 
 
-def get_rule_hashes(conf):
+def get_rule_hashes(conf, prev_hashes=None):
+    """ Returns a dictionary mapping each rule file in rules_folder to a tuple of its
+    modification time and a hash of its contents. Files whose modification time is
+    unchanged from prev_hashes are not read again.
+
+    :param conf: The global configuration.
+    :param prev_hashes: The result of a previous call to get_rule_hashes.
+    """
+    prev_hashes = prev_hashes or {}
     rules_folder = conf['rules_folder']
     rule_files = os.listdir(rules_folder)
-    rule_mod_times = {}
+    rule_hashes = {}
     for rule_file in rule_files:
         if '.yaml' != rule_file[-5:]:
             continue
-        with open(os.path.join(rules_folder, rule_file)) as fh:
-            rule_mod_times[rule_file] = hashlib.sha1(fh.read()).digest()
-    return rule_mod_times
+        rule_path = os.path.join(rules_folder, rule_file)
+        mod_time = os.path.getmtime(rule_path)
+        if rule_file in prev_hashes and prev_hashes[rule_file][0] == mod_time:
+            rule_hashes[rule_file] = prev_hashes[rule_file]
+            continue
+        with open(rule_path) as fh:
+            rule_hashes[rule_file] = (mod_time, hashlib.sha1(fh.read()).digest())
+    return rule_hashes
@@ -1,22 +1,27 @@
 # -*- coding: utf-8 -*-
+import collections
 import copy
 import datetime
-import json
 import logging
 import os
 import sys
+import threading
 import time
 import traceback
+import uuid
 
 import argparse
+from multiprocessing.pool import ThreadPool
 
 import kibana
 from alerts import DebugAlerter
 from config import load_rules
 from config import get_rule_hashes
 from config import load_configuration
+from util import dt_now
 from util import dt_to_ts
 from util import EAException
+from util import FastJSONSerializer
 from util import pretty_ts
 from util import ts_add
 from util import ts_delta
@@ -51,13 +56,18 @@ class ElastAlerter():
         parser.add_argument('--end', dest='end', help='YYYY-MM-DDTHH:MM:SS Query to this timestamp. (Default: present)')
         parser.add_argument('--verbose', action='store_true', dest='verbose', help='Increase verbosity without suppressing alerts')
         parser.add_argument('--pin_rules', action='store_true', dest='pin_rules', help='Stop ElastAlert from monitoring config file changes')
+        parser.add_argument('--threads', type=int, dest='threads', help='Number of rules to query concurrently (Default: rule_concurrency from config)')
         self.args = parser.parse_args(args)
 
     def __init__(self, args):
         self.parse_args(args)
         self.conf = load_rules(self.args.config, use_rule=self.args.rule)
         self.max_query_size = self.conf['max_query_size']
+        self.scroll_size = self.conf['scroll_size']
+        self.scroll_keepalive = self.conf['scroll_keepalive']
         self.rules = self.conf['rules']
+        if self.args.threads:
+            self.conf['rule_concurrency'] = self.args.threads
         self.debug = self.args.debug
         self.verbose = self.args.verbose
         self.writeback_index = self.conf['writeback_index']
@@ -66,15 +76,30 @@ class ElastAlerter():
         self.run_every = self.conf['run_every']
         self.alert_time_limit = self.conf['alert_time_limit']
         self.old_query_limit = self.conf['old_query_limit']
-        self.alerts_sent = 0
-        self.num_hits = 0
-        self.current_es = None
-        self.current_es_addr = None
+        # Elasticsearch clients, current_es, num_hits and alerts_sent are kept per thread, since rules run concurrently
+        self.thread_data = threading.local()
+        self.init_thread_data()
+        self.rule_pool = ThreadPool(self.conf['rule_concurrency'], self.init_thread_data)
+        self.chunk_pool = ThreadPool(self.conf['rule_concurrency'], self.init_thread_data)
+        self.dashboard_cache = {}
         self.buffer_time = self.conf['buffer_time']
         self.silence_cache = {}
+        self.silence_cache_ttl = self.conf['silence_cache_ttl']
+        self.cycle_now = None
         self.rule_hashes = get_rule_hashes(self.conf)
+        self.writeback_buffer = []
+        self.writeback_lock = threading.Lock()
+        self.writeback_flush_size = self.conf['writeback_flush_size']
+        self.writeback_flush_interval = self.conf['writeback_flush_interval']
+        self.writeback_flusher = None
+        self.serializer = FastJSONSerializer()
 
-        self.writeback_es = Elasticsearch(host=self.es_host, port=self.es_port)
+        self.pending_alerts_template = self.get_pending_alerts_template()
+
+        # The writeback client is shared by every rule thread and kept for the lifetime of ElastAlert.
+        # Timeouts aren't retried, since a retried create without an _id could write the document twice
+        self.writeback_es = Elasticsearch(host=self.es_host, port=self.es_port, serializer=self.serializer,
+                                          maxsize=self.conf['rule_concurrency'])
 
         if self.debug:
             self.verbose = True
@@ -84,10 +109,28 @@ class ElastAlerter():
 
         for rule in self.rules:
             rule = self.init_rule(rule)
+        self.rules_by_name = dict((rule['name'], rule) for rule in self.rules)
 
         if self.args.silence:
             self.silence()
 
+    def init_thread_data(self):
+        """ Sets the initial per thread state. Used as the initializer for the thread pools. """
+        self.thread_data.es_clients = {}
+        self.thread_data.current_es = None
+        self.thread_data.num_hits = 0
+        self.thread_data.alerts_sent = 0
+        self.thread_data.last_exception = None
+        self.thread_data.last_traceback_lines = None
+
+    def get_es_client(self, host, port):
+        """ Returns the calling thread's Elasticsearch client for host and port. Clients are kept for
+        the lifetime of the thread so that their connection pools are reused between queries. """
+        es_clients = self.thread_data.es_clients
+        if (host, port) not in es_clients:
+            es_clients[(host, port)] = Elasticsearch(host=host, port=port, serializer=self.serializer)
+        return es_clients[(host, port)]
+
     def get_index(self, rule, starttime=None, endtime=None):
         """ Gets the index for a rule. If strftime is set and starttime and endtime
         are provided, it will return a comma seperated list of indices. If strftime
@@ -97,14 +140,20 @@ class ElastAlerter():
         if rule.get('use_strftime_index'):
             if starttime and endtime:
                 return format_index(index, starttime, endtime)
+            elif 'index_wildcard' in rule:
+                return rule['index_wildcard']
             else:
-                # Replace the substring containing format characters with a *
-                format_start = index.find('%')
-                format_end = index.rfind('%') + 2
-                return index[:format_start] + '*' + index[format_end:]
+                return self.get_index_wildcard(index)
         else:
             return index
 
+    @staticmethod
+    def get_index_wildcard(index):
+        """ Replace the substring of a strftime index containing format characters with a *. """
+        format_start = index.find('%')
+        format_end = index.rfind('%') + 2
+        return index[:format_start] + '*' + index[format_end:]
+
     @staticmethod
     def get_query(filters, starttime=None, endtime=None, sort=True, timestamp_field='@timestamp'):
         """ Returns a query dict that will apply a list of filters, filter by
@@ -116,15 +165,28 @@ class ElastAlerter():
         :param sort: If true, sort results by timestamp. (Default True)
         :return: A query dictionary to pass to elasticsearch.
         """
-        filters = copy.copy(filters)
-        query = {'filter': {'bool': {'must': filters}}}
         if starttime and endtime:
-            query['filter']['bool']['must'].append({'range': {timestamp_field: {'from': starttime,
-                                                                                'to': endtime}}})
+            filters = filters + [{'range': {timestamp_field: {'from': starttime,
+                                                              'to': endtime}}}]
+        query = {'filter': {'bool': {'must': filters}}}
         if sort:
             query['sort'] = [{timestamp_field: {'order': 'asc'}}]
         return query
 
+    def get_query_template(self, rule):
+        """ Returns the JSON body of get_query for rule, with __STARTTIME__ and __ENDTIME__ in place of
+        the time range. The filters only have to be serialized once per rule instead of once per query. """
+        query = self.get_query(rule['filter'], '__STARTTIME__', '__ENDTIME__', timestamp_field=rule['timestamp_field'])
+        return self.serializer.dumps(query)
+
+    def get_pending_alerts_template(self):
+        """ Returns the JSON body of the query for unsent alerts, with __STARTTIME__ and __ENDTIME__
+        in place of the alert_time range. """
+        query = {'query': {'filtered': {'filter': {'bool': {'must': [
+            {'term': {'alert_sent': False}},
+            {'range': {'alert_time': {'from': '__STARTTIME__', 'to': '__ENDTIME__'}}}]}}}}}
+        return self.serializer.dumps(query)
+
     def get_terms_query(self, query, size, field):
         """ Takes a query generated by get_query and outputs a aggregation query """
         if 'sort' in query:
@@ -141,7 +203,7 @@ class ElastAlerter():
         """
         query = {'sort': {timestamp_field: {'order': 'asc'}}}
         try:
-            res = self.current_es.search(index=index, size=1, body=query, _source_include=[timestamp_field])
+            res = self.thread_data.current_es.search(index=index, size=1, body=query, _source_include=[timestamp_field])
         except ElasticsearchException as e:
             self.handle_error("Elasticsearch query error: %s" % (e), {'index': index})
             return '1969-12-30T00:00:00Z'
@@ -157,11 +219,29 @@ class ElastAlerter():
         :param rule: The rule configuration.
         :param starttime: The earliest time to query.
         :param endtime: The latest time to query.
-        :return: A list of hits, bounded by self.max_query_size.
+        :return: A list of hits, bounded by max_query_size. If they don't fit in one page of
+        scroll_size hits, the rest are fetched with the scroll API.
         """
-        query = self.get_query(rule['filter'], starttime, endtime, timestamp_field=rule['timestamp_field'])
+        query = rule['query_template'].replace('__STARTTIME__', starttime).replace('__ENDTIME__', endtime)
+        max_size = rule.get('max_query_size', self.max_query_size)
+        size = min(max_size, self.scroll_size)
+        # If there may be more than one page, the first request opens the scroll the others continue
+        params = {'scroll': self.scroll_keepalive} if max_size > size else {}
+        es = self.thread_data.current_es
+        scroll_id = None
         try:
-            res = self.current_es.search(index=index, size=self.max_query_size, body=query, _source_include=rule['include'])
+            res = es.search(index=index, size=size, body=query, _source_include=rule['include'], params=params)
+            scroll_id = res.get('_scroll_id')
+            hits = res['hits']['hits']
+            total = res['hits']['total']
+            limit = min(total, max_size)
+            if scroll_id and len(hits) < limit:
+                logging.info("Query for %s has %s hits, scrolling %s at a time" % (rule['name'], total, size))
+            while scroll_id and res['hits']['hits'] and len(hits) < limit:
+                res = es.scroll(scroll_id=scroll_id, scroll=self.scroll_keepalive)
+                scroll_id = res.get('_scroll_id')
+                hits += res['hits']['hits']
+            del hits[max_size:]
         except ElasticsearchException as e:
             # Elasticsearch sometimes gives us GIGANTIC error messages
             # (so big that they will fill the entire terminal buffer)
@@ -169,11 +249,19 @@ class ElastAlerter():
                 e = str(e)[:1024] + '... (%d characters removed)' % (len(str(e)) - 1024)
             self.handle_error('Error running query: %s' % (e), {'rule': rule['name']})
             return None
+        finally:
+            if scroll_id:
+                try:
+                    es.clear_scroll(scroll_id=scroll_id)
+                except ElasticsearchException:
+                    pass
 
-        hits = res['hits']['hits']
-        self.num_hits += len(hits)
-        lt = rule.get('use_local_time')
-        logging.info("Queried rule %s from %s to %s: %s hits" % (rule['name'], pretty_ts(starttime, lt), pretty_ts(endtime, lt), len(hits)))
+        # Warn if we hit max_query_size
+        if total > max_size:
+            logging.warning("Hit max_query_size (%s) while querying for %s" % (max_size, rule['name']))
+
+        self.thread_data.num_hits += len(hits)
+        self.log_query(rule, starttime, endtime, '%s hits' % (len(hits)))
 
         return hits
 
@@ -191,7 +279,8 @@ class ElastAlerter():
         query = {'query': {'filtered': query}}
 
         try:
-            res = self.current_es.count(index=index, doc_type=rule['doc_type'], body=query)
+            res = self.thread_data.current_es.count(index=index, doc_type=rule['doc_type'], body=query,
+                                                    params={'filter_path': 'count'})
         except ElasticsearchException as e:
             # Elasticsearch sometimes gives us GIGANTIC error messages
             # (so big that they will fill the entire terminal buffer)
@@ -200,9 +289,8 @@ class ElastAlerter():
             self.handle_error('Error running count query: %s' % (e), {'rule': rule['name']})
             return None
 
-        self.num_hits += res['count']
-        lt = rule.get('use_local_time')
-        logging.info("Queried rule %s from %s to %s: %s hits" % (rule['name'], pretty_ts(starttime, lt), pretty_ts(endtime, lt), res['count']))
+        self.thread_data.num_hits += res['count']
+        self.log_query(rule, starttime, endtime, '%s hits' % (res['count']))
         return {endtime: res['count']}
 
     def get_hits_terms(self, rule, starttime, endtime, index):
@@ -210,7 +298,12 @@ class ElastAlerter():
         query = self.get_terms_query(base_query, rule['terms_size'], rule['query_key'])
 
         try:
-            res = self.current_es.search(index=index, doc_type=rule['doc_type'], body=query, search_type='count')
+            # Only the bucket keys and counts are used, so have ES strip everything else.
+            # The query_cache lets repeated windows be answered from the shard cache
+            res = self.thread_data.current_es.search(index=index, doc_type=rule['doc_type'], body=query, search_type='count',
+                                                     params={'filter_path': 'aggregations.filtered.counts.buckets.key,'
+                                                                            'aggregations.filtered.counts.buckets.doc_count',
+                                                             'query_cache': 'true'})
         except ElasticsearchException as e:
             # Elasticsearch sometimes gives us GIGANTIC error messages
             # (so big that they will fill the entire terminal buffer)
@@ -219,31 +312,46 @@ class ElastAlerter():
             self.handle_error('Error running query: %s' % (e), {'rule': rule['name']})
             return None
 
-        buckets = res['aggregations']['filtered']['counts']['buckets']
-        self.num_hits += len(buckets)
-        lt = rule.get('use_local_time')
-        logging.info('Queried rule %s from %s to %s: %s buckets' % (rule['name'], pretty_ts(starttime, lt), pretty_ts(endtime, lt), len(buckets)))
+        # filter_path omits the aggregations entirely when there are no buckets
+        buckets = res.get('aggregations', {}).get('filtered', {}).get('counts', {}).get('buckets', [])
+        self.thread_data.num_hits += len(buckets)
+        self.log_query(rule, starttime, endtime, '%s buckets' % (len(buckets)))
         return {endtime: buckets}
 
-    def remove_duplicate_events(self, data, rule):
-        # Remove data we've processed already
-        data = [event for event in data if event['_id'] not in rule['processed_hits']]
+    @staticmethod
+    def log_query(rule, starttime, endtime, result):
+        """ Logs the time range and result size of a query. The timestamps are only
+        formatted if INFO messages will actually be emitted. """
+        if not logging.getLogger().isEnabledFor(logging.INFO):
+            return
+        lt = rule.get('use_local_time')
+        logging.info('Queried rule %s from %s to %s: %s' % (rule['name'], pretty_ts(starttime, lt), pretty_ts(endtime, lt), result))
 
-        # Remember the new data's IDs
+    def remove_duplicate_events(self, data, rule):
+        # Remove data we've processed already and remember the new data's IDs
+        processed_hits = rule['processed_hits']
+        timestamp_field = rule['timestamp_field']
+        new_events = []
         for event in data:
-            rule['processed_hits'][event['_id']] = event['_source'][rule['timestamp_field']]
+            if event['_id'] in processed_hits:
+                continue
+            processed_hits[event['_id']] = ts_to_dt(event['_source'][timestamp_field])
+            new_events.append(event['_source'])
 
-        return [event['_source'] for event in data]
+        return new_events
 
-    def remove_old_events(self, rule):
+    def remove_old_events(self, rule, now=None):
         # Anything older than the buffer time we can forget
-        now = ts_now()
-        remove = []
+        # Hits are kept in the order they were queried, so the oldest are at the front
+        if now is None:
+            now = dt_now()
         buffer_time = rule.get('buffer_time', self.buffer_time)
-        for _id, timestamp in rule['processed_hits'].iteritems():
-            if ts_delta(timestamp, now) > buffer_time:
-                remove.append(_id)
-        map(rule['processed_hits'].pop, remove)
+        processed_hits = rule['processed_hits']
+        while processed_hits:
+            timestamp = processed_hits[next(iter(processed_hits))]
+            if now - timestamp <= buffer_time:
+                break
+            processed_hits.popitem(last=False)
 
     def run_query(self, rule, start=None, end=None):
         """ Query for the rule and pass all of the results to the RuleType instance.
@@ -258,35 +366,45 @@ class ElastAlerter():
         if end is None:
             end = ts_now()
 
-        # Reset hit counter and query
-        rule_inst = rule['type']
-        prev_num_hits = self.num_hits
-        max_size = rule.get('max_query_size', self.max_query_size)
+        data = self.get_query_data(rule, start, end)
+        return self.process_query_data(rule, data)
+
+    def get_query_data(self, rule, start, end):
+        """ Query for the rule using the count, terms or search API, as configured.
+        Returns the data to pass to the RuleType instance, or None on failure. """
         index = self.get_index(rule, start, end)
         if rule.get('use_count_query'):
-            data = self.get_hits_count(rule, start, end, index)
+            return self.get_hits_count(rule, start, end, index)
         elif rule.get('use_terms_query'):
-            data = self.get_hits_terms(rule, start, end, index)
+            return self.get_hits_terms(rule, start, end, index)
         else:
-            data = self.get_hits(rule, start, end, index)
-            if data:
-                data = self.remove_duplicate_events(data, rule)
-
+            return self.get_hits(rule, start, end, index)
+
+    def query_chunk(self, rule, start, end):
+        """ Runs get_query_data from a chunk_pool thread.
+        Returns a tuple of the data and the number of hits it counted. """
+        self.thread_data.current_es = self.get_es_client(rule['es_host'], rule['es_port'])
+        self.thread_data.num_hits = 0
+        data = self.get_query_data(rule, start, end)
+        return data, self.thread_data.num_hits
+
+    def process_query_data(self, rule, data):
+        """ Pass the results of get_query_data to the RuleType instance.
+        Returns True on success and False if the query had failed. """
         # There was an exception while querying
         if data is None:
             return False
+
+        rule_inst = rule['type']
+        if rule.get('use_count_query'):
+            rule_inst.add_count_data(data)
+        elif rule.get('use_terms_query'):
+            rule_inst.add_terms_data(data)
         elif data:
-            if rule.get('use_count_query'):
-                rule_inst.add_count_data(data)
-            elif rule.get('use_terms_query'):
-                rule_inst.add_terms_data(data)
-            else:
+            data = self.remove_duplicate_events(data, rule)
+            if data:
                 rule_inst.add_data(data)
 
-        # Warn if we hit max_query_size
-        if self.num_hits - prev_num_hits == max_size and not rule.get('use_count_query'):
-            logging.warning("Hit max_query_size (%s) while querying for %s" % (max_size, rule['name']))
-
         return True
 
     def get_starttime(self, rule):
@@ -298,20 +416,18 @@ class ElastAlerter():
         query = {'filter': {'term': {'rule_name': '%s' % (rule['name'])}},
                  'sort': {'@timestamp': {'order': 'desc'}}}
         try:
-            if self.writeback_es:
-                res = self.writeback_es.search(index=self.writeback_index, doc_type='elastalert_status',
-                                               size=1, body=query, _source_include=['endtime', 'rule_name'])
-                if res['hits']['hits']:
-                    endtime = res['hits']['hits'][0]['_source']['endtime']
-
-                    if ts_delta(endtime, ts_now()) < self.old_query_limit:
-                        return endtime
-                    else:
-                        logging.info("Found expired previous run for %s at %s" % (rule['name'], endtime))
-                        return None
+            res = self.writeback_es.search(index=self.writeback_index, doc_type='elastalert_status',
+                                           size=1, body=query, _source_include=['endtime', 'rule_name'])
+            if res['hits']['hits']:
+                endtime = res['hits']['hits'][0]['_source']['endtime']
+
+                if ts_delta(endtime, ts_now()) < self.old_query_limit:
+                    return endtime
+                else:
+                    logging.info("Found expired previous run for %s at %s" % (rule['name'], endtime))
+                    return None
         except (ElasticsearchException, KeyError) as e:
             self.handle_error('Error querying for last run: %s' % (e), {'rule': rule['name']})
-            self.writeback_es = None
 
         return None
 
@@ -333,17 +449,19 @@ class ElastAlerter():
         else:
             rule['starttime'] = ts_add(endtime, -self.run_every)
 
-    def run_rule(self, rule, endtime, starttime=None):
+    def run_rule(self, rule, endtime, starttime=None, now=None):
         """ Run a rule for a given time period, including querying and alerting on results.
 
         :param rule: The rule configuration.
         :param starttime: The earliest timestamp to query.
         :param endtime: The latest timestamp to query.
+        :param now: The current time as a datetime, shared by everything in this cycle.
         :return: The number of matches that the rule produced.
         """
+        if now is None:
+            now = dt_now()
         run_start = time.time()
-        self.current_es = Elasticsearch(host=rule['es_host'], port=rule['es_port'])
-        self.current_es_addr = (rule['es_host'], rule['es_port'])
+        self.thread_data.current_es = self.get_es_client(rule['es_host'], rule['es_port'])
 
         # If there are pending aggregate matches, try processing them
         for x in range(len(rule['agg_matches'])):
@@ -358,50 +476,63 @@ class ElastAlerter():
         rule['original_starttime'] = rule['starttime']
 
         # Don't run if starttime was set to the future
-        if ts_delta(rule['starttime'], ts_now()) <= datetime.timedelta(0):
+        if now - ts_to_dt(rule['starttime']) <= datetime.timedelta(0):
             logging.warning("Attempted to use query start time in the future (%s), sleeping instead" % (starttime))
             return 0
 
         # Run the rule
         # If querying over a large time period, split it up into chunks
-        self.num_hits = 0
-        tmp_endtime = endtime
+        self.thread_data.num_hits = 0
         buffer_time = rule.get('buffer_time', self.buffer_time)
-        while ts_delta(rule['starttime'], endtime) > buffer_time:
-            tmp_endtime = ts_add(rule['starttime'], self.run_every)
-            if not self.run_query(rule, rule['starttime'], tmp_endtime):
+        chunks = []
+        chunk_start = rule['starttime']
+        while ts_delta(chunk_start, endtime) > buffer_time:
+            chunk_end = ts_add(chunk_start, self.run_every)
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+        chunks.append((chunk_start, endtime))
+
+        if len(chunks) == 1:
+            if not self.run_query(rule, rule['starttime'], endtime):
                 return 0
-            rule['starttime'] = tmp_endtime
-        if not self.run_query(rule, rule['starttime'], endtime):
-            return 0
+        else:
+            # Query a batch of chunks at once, then pass the results to the rule in time order
+            batch_size = self.conf['rule_concurrency']
+            for i in range(0, len(chunks), batch_size):
+                batch = chunks[i:i + batch_size]
+                results = self.chunk_pool.map(lambda chunk: self.query_chunk(rule, *chunk), batch)
+                for (chunk_start, chunk_end), (data, num_hits) in zip(batch, results):
+                    rule['starttime'] = chunk_start
+                    self.thread_data.num_hits += num_hits
+                    if not self.process_query_data(rule, data):
+                        return 0
 
         rule['type'].garbage_collect(endtime)
 
         # Process any new matches
         num_matches = len(rule['type'].matches)
+
+        # Look up the silence status of every key these matches use in one request
+        silences_fetched = False
+        if rule['type'].matches:
+            silence_names = set([rule['name']])
+            silence_names.update(rule['name'] + self.get_silence_key(rule, match) for match in rule['type'].matches)
+            silences_fetched = self.fetch_silences(silence_names)
+
         while rule['type'].matches:
             match = rule['type'].matches.pop(0)
 
             # If realert is set, silence the rule for that duration
             # Silence is cached by query_key, if it exists
             # Default realert time is 0 seconds
+            key = self.get_silence_key(rule, match)
 
-            # concatenate query_key (or none) with rule_name to form silence_cache key
-            if 'query_key' in rule:
-                try:
-                    key = '.' + match[rule['query_key']]
-                except KeyError:
-                    # Some matches may not have a query key
-                    key = ''
-            else:
-                key = ''
-
-            if self.is_silenced(rule['name'] + key) or self.is_silenced(rule['name']):
+            if self.is_silenced(rule['name'] + key, silences_fetched) or self.is_silenced(rule['name'], silences_fetched):
                 logging.info('Ignoring match for silenced rule %s%s' % (rule['name'], key))
                 continue
 
             if rule['realert']:
-                self.set_realert(rule['name'] + key, dt_to_ts(datetime.datetime.utcnow() + rule['realert']))
+                self.set_realert(rule['name'] + key, dt_to_ts(now + rule['realert']))
 
             # If no aggregation, alert immediately
             if not rule['aggregation']:
@@ -417,13 +548,24 @@ class ElastAlerter():
                 'endtime': endtime,
                 'starttime': rule['starttime'],
                 'matches': num_matches,
-                'hits': self.num_hits,
-                '@timestamp': ts_now(),
+                'hits': self.thread_data.num_hits,
+                '@timestamp': dt_to_ts(now),
                 'time_taken': time_taken}
-        self.writeback('elastalert_status', body)
+        self.buffer_writeback('elastalert_status', body)
 
         return num_matches
 
+    def get_silence_key(self, rule, match):
+        """ Returns the query_key part of the silence_cache key for match, which is
+        concatenated with the rule name. """
+        if 'query_key' in rule:
+            try:
+                return '.' + match[rule['query_key']]
+            except KeyError:
+                # Some matches may not have a query key
+                return ''
+        return ''
+
     def init_rule(self, new_rule, new=True):
         ''' Copies some necessary non-config state from an exiting rule to a new rule. '''
         if 'download_dashboard' in new_rule['filter']:
@@ -433,18 +575,23 @@ class ElastAlerter():
                 new_rule['filter'] = db_filters
             else:
                 raise EAException("Could not download filters from %s" % (new_rule['filter']['download_dashboard']))
+        new_rule['query_template'] = self.get_query_template(new_rule)
+        # Alerters' info only depends on their configuration, so it is fetched once per (re)load
+        new_rule['alerter_info'] = [alert.get_info() for alert in new_rule['alert']]
+        if self.debug:
+            new_rule['debug_alerter'] = DebugAlerter(new_rule)
+        if new_rule.get('use_strftime_index'):
+            new_rule['index_wildcard'] = self.get_index_wildcard(new_rule['index'])
 
         blank_rule = {'agg_matches': [],
                       'current_aggregate_id': None,
-                      'processed_hits': {}}
+                      'processed_hits': collections.OrderedDict()}
         rule = blank_rule
 
         # Set rule to either a blank template or existing rule with same name
         if not new:
-            for rule in self.rules:
-                if rule['name'] == new_rule['name']:
-                    break
-            else:
+            rule = self.rules_by_name.get(new_rule['name'])
+            if rule is None:
                 logging.warning("Couldn't find existing rule %s, starting from scratch" % (new_rule['name']))
                 rule = blank_rule
 
@@ -462,16 +609,20 @@ class ElastAlerter():
     def load_rule_changes(self):
         ''' Using the modification times of rule config files, syncs the running rules
         to match the files in rules_folder by removing, adding or reloading rules. '''
-        rule_hashes = get_rule_hashes(self.conf)
+        rule_hashes = get_rule_hashes(self.conf, self.rule_hashes)
+
+        # Rules being (re)loaded should see the current version of their dashboards
+        if rule_hashes != self.rule_hashes:
+            self.dashboard_cache = {}
 
         # Check each current rule for changes
-        for rule_file, hash_value in self.rule_hashes.iteritems():
+        for rule_file, (mod_time, hash_value) in self.rule_hashes.iteritems():
             if rule_file not in rule_hashes:
                 # Rule file was deleted
                 logging.info('Rule file %s not found, stopping rule execution' % (rule_file))
                 self.rules = [rule for rule in self.rules if rule['rule_file'] != rule_file]
                 continue
-            if hash_value != rule_hashes[rule_file]:
+            if hash_value != rule_hashes[rule_file][1]:
                 # Rule file was changed, reload rule
                 try:
                     new_rule = load_configuration(os.path.join(self.conf['rules_folder'], rule_file))
@@ -495,6 +646,36 @@ class ElastAlerter():
                 self.rules.append(self.init_rule(new_rule))
 
         self.rule_hashes = rule_hashes
+        self.rules_by_name = dict((rule['name'], rule) for rule in self.rules)
+
+    def execute_rule(self, rule, starttime=None, now=None):
+        """ Runs a single rule up to its endtime and logs the result. This is called
+        concurrently for each rule from the rule_pool threads. """
+        self.thread_data.alerts_sent = 0
+        if now is None:
+            now = dt_now()
+
+        # Set endtime based on the rule's delay
+        delay = rule.get('query_delay')
+        if hasattr(self.args, 'end') and self.args.end:
+            endtime = dt_to_ts(ts_to_dt(self.args.end))
+        elif delay:
+            endtime = dt_to_ts(now - delay)
+        else:
+            endtime = dt_to_ts(now)
+
+        try:
+            num_matches = self.run_rule(rule, endtime, starttime, now)
+        except EAException as e:
+            self.handle_error("Error running rule %s: %s" % (rule['name'], e), {'rule': rule['name']})
+        else:
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                old_starttime = pretty_ts(rule.get('original_starttime'), rule.get('use_local_time'))
+                logging.info("Ran %s from %s to %s: %s query hits, %s matches,"
+                             " %s alerts sent" % (rule['name'], old_starttime, pretty_ts(endtime, rule.get('use_local_time')),
+                                                  self.thread_data.num_hits, num_matches, self.thread_data.alerts_sent))
+
+        self.remove_old_events(rule, now)
 
     def start(self):
         """ Periodically go through each rule and run it """
@@ -505,43 +686,32 @@ class ElastAlerter():
             except (TypeError, ValueError):
                 self.handle_error("%s is not a valid ISO 8601 timestamp (YYYY-MM-DDTHH:MM:SS+XX:00)" % (starttime))
                 exit(1)
+
+        # Look up the silence status of every rule with one request
+        self.fetch_silences([rule['name'] for rule in self.rules])
+
+        # Buffered writeback documents are written in the background while rules run
+        self.start_writeback_flusher()
+
         while True:
-            # If writeback_es errored, it's disabled until the next query cycle
-            if not self.writeback_es:
-                self.writeback_es = Elasticsearch(host=self.es_host, port=self.es_port)
+            # Everything in this cycle shares the same notion of the current time
+            now = self.cycle_now = dt_now()
 
+            self.expire_silence_cache()
             self.send_pending_alerts()
 
             next_run = datetime.datetime.utcnow() + self.run_every
 
-            for rule in self.rules:
-                # Set endtime based on the rule's delay
-                delay = rule.get('query_delay')
-                if hasattr(self.args, 'end') and self.args.end:
-                    endtime = dt_to_ts(ts_to_dt(self.args.end))
-                elif delay:
-                    endtime = dt_to_ts(datetime.datetime.utcnow() - delay)
-                else:
-                    endtime = ts_now()
-
-                try:
-                    num_matches = self.run_rule(rule, endtime, starttime)
-                except EAException as e:
-                    self.handle_error("Error running rule %s: %s" % (rule['name'], e), {'rule': rule['name']})
-                else:
-                    old_starttime = pretty_ts(rule.get('original_starttime'), rule.get('use_local_time'))
-                    logging.info("Ran %s from %s to %s: %s query hits, %s matches,"
-                                 " %s alerts sent" % (rule['name'], old_starttime, pretty_ts(endtime, rule.get('use_local_time')),
-                                                      self.num_hits, num_matches, self.alerts_sent))
-                    self.alerts_sent = 0
+            self.rule_pool.map(lambda rule: self.execute_rule(rule, starttime, now), self.rules)
 
-                self.remove_old_events(rule)
+            # Write the status and silence documents collected during this cycle
+            self.flush_writeback()
 
             if next_run < datetime.datetime.utcnow():
                 # We were processing for longer than our refresh interval
                 # This can happen if --start was specified with a large time period
                 # or if we are running too slow to process events in real time.
-                logging.warning("Querying from %s to %s took longer than %s!" % (old_starttime, endtime, self.run_every))
+                logging.warning("Querying for %s rules took longer than %s!" % (len(self.rules), self.run_every))
                 continue
 
             # Only force starttime once
@@ -551,26 +721,31 @@ class ElastAlerter():
                 self.load_rule_changes()
 
             # Wait before querying again
-            sleep_for = (next_run - datetime.datetime.utcnow()).seconds
+            # Reloading rules may have used up the rest of the interval, in which case
+            # the timedelta is negative and its seconds attribute would be nearly a day
+            sleep_for = max(0, (next_run - datetime.datetime.utcnow()).total_seconds())
             logging.info("Sleeping for %s seconds" % (sleep_for))
             time.sleep(sleep_for)
 
     def generate_kibana_db(self, rule, match):
         ''' Uses a template dashboard to upload a temp dashboard showing the match.
         Returns the url to the dashboard. '''
-        db = copy.deepcopy(kibana.dashboard_temp)
+        # The filters, fields and index only depend on the rule, so they're set up once per rule
+        if 'kibana_db' not in rule:
+            db = copy.deepcopy(kibana.dashboard_temp)
 
-        # Set filters
-        for filter in rule['filter']:
-            if filter:
-                kibana.add_filter(db, filter)
-        kibana.set_included_fields(db, rule['include'])
+            # Set filters
+            for filter in rule['filter']:
+                if filter:
+                    kibana.add_filter(db, filter)
+            kibana.set_included_fields(db, rule['include'])
 
-        # Set index
-        index = self.get_index(rule)
-        kibana.set_index_name(db, index)
+            # Set index
+            index = self.get_index(rule)
+            kibana.set_index_name(db, index)
+            rule['kibana_db'] = db
 
-        return self.upload_dashboard(db, rule, match)
+        return self.upload_dashboard(kibana.copy_dashboard(rule['kibana_db']), rule, match)
 
     def upload_dashboard(self, db, rule, match):
         ''' Uploads a dashboard schema to the kibana-int elasticsearch index associated with rule.
@@ -591,14 +766,14 @@ class ElastAlerter():
                 kibana.add_filter(db, term)
 
         # Convert to json
-        db_js = json.dumps(db)
+        db_js = self.serializer.dumps(db)
         db_body = {'user': 'guest',
                    'group': 'guest',
                    'title': db_name,
                    'dashboard': db_js}
 
         # Upload
-        es = Elasticsearch(host=rule['es_host'], port=rule['es_port'])
+        es = self.get_es_client(rule['es_host'], rule['es_port'])
         res = es.create(index='kibana-int',
                         doc_type='temp',
                         body=db_body)
@@ -611,20 +786,25 @@ class ElastAlerter():
         return kibana_url + '#/dashboard/temp/%s' % (res['_id'])
 
     def get_dashboard(self, rule, db_name):
-        """ Download dashboard which matches use_kibana_dashboard from elasticsearch. """
-        es = Elasticsearch(host=rule['es_host'], port=rule['es_port'])
+        """ Download dashboard which matches use_kibana_dashboard from elasticsearch.
+        Dashboards are cached, so rules sharing a dashboard only download it once. """
         if not db_name:
             raise EAException("use_kibana_dashboard undefined")
-        query = {'query': {'term': {'_id': db_name}}}
-        try:
-            res = es.search(index='kibana-int', doc_type='dashboard', body=query, _source_include=['dashboard'])
-        except ElasticsearchException as e:
-            raise EAException("Error querying for dashboard: %s" % (e))
+        cache_key = (rule['es_host'], rule['es_port'], db_name)
+        if cache_key not in self.dashboard_cache:
+            es = self.get_es_client(rule['es_host'], rule['es_port'])
+            query = {'query': {'term': {'_id': db_name}}}
+            try:
+                res = es.search(index='kibana-int', doc_type='dashboard', body=query, _source_include=['dashboard'])
+            except ElasticsearchException as e:
+                raise EAException("Error querying for dashboard: %s" % (e))
 
-        if res['hits']['hits']:
-            return json.loads(res['hits']['hits'][0]['_source']['dashboard'])
-        else:
-            raise EAException("Could not find dashboard named %s" % (db_name))
+            if not res['hits']['hits']:
+                raise EAException("Could not find dashboard named %s" % (db_name))
+            self.dashboard_cache[cache_key] = self.serializer.loads(res['hits']['hits'][0]['_source']['dashboard'])
+
+        # Callers may modify the dashboard, so never hand out the cached copy
+        return copy.deepcopy(self.dashboard_cache[cache_key])
 
     def use_kibana_link(self, rule, match):
         """ Uploads an existing dashboard as a temp dashboard modified for match time.
@@ -658,6 +838,9 @@ class ElastAlerter():
         :param matches: A list of matches.
         :param rule: A rule configuration.
         """
+        if not matches:
+            return
+
         if alert_time is None:
             alert_time = ts_now()
 
@@ -675,47 +858,53 @@ class ElastAlerter():
                     matches[0]['kibana_link'] = kb_link
 
         for enhancement in rule['match_enhancements']:
+            process = enhancement.process
             for match in matches:
                 try:
-                    enhancement.process(match)
+                    process(match)
                 except EAException as e:
                     self.handle_error("Error running match enhancement: %s" % (e), {'rule': rule['name']})
 
         # Don't send real alerts in debug mode
         if self.debug:
-            alerter = DebugAlerter(rule)
-            alerter.alert(matches)
+            rule['debug_alerter'].alert(matches)
             return
 
         # Run the alerts
         alert_sent = False
         alert_exception = None
-        for alert in rule['alert']:
+        for alert, alert_info in zip(rule['alert'], rule['alerter_info']):
             try:
                 alert.alert(matches)
             except EAException as e:
-                self.handle_error('Error while running alert %s: %s' % (alert.get_info()['type'], e), {'rule': rule['name']})
+                self.handle_error('Error while running alert %s: %s' % (alert_info['type'], e), {'rule': rule['name']})
                 alert_exception = str(e)
             else:
-                self.alerts_sent += 1
+                self.thread_data.alerts_sent += 1
                 alert_sent = True
 
-        # Write the alert(s) to ES
-        agg_id = None
+        # Write the alert(s) to ES. The first document's _id is generated here so that
+        # the others can reference it as their aggregate_id in the same bulk request
+        agg_id = uuid.uuid4().hex if len(matches) > 1 else None
+        docs = []
+        # Everything but the match body is the same for each document
+        alert_template = self.get_alert_body(matches[0], rule, alert_sent, alert_time, alert_exception)
         for match in matches:
-            alert_body = self.get_alert_body(match, rule, alert_sent, alert_time, alert_exception)
+            alert_body = dict(alert_template)
+            alert_body['match_body'] = match
             # Set all matches to aggregate together
-            if agg_id:
+            if docs:
                 alert_body['aggregate_id'] = agg_id
-            res = self.writeback('elastalert', alert_body)
-            if res and not agg_id:
-                agg_id = res['_id']
+                docs.append(('elastalert', alert_body, None))
+            else:
+                docs.append(('elastalert', alert_body, agg_id))
+        self.writeback_bulk(docs)
 
     def get_alert_body(self, match, rule, alert_sent, alert_time, alert_exception=None):
         body = {'match_body': match}
         body['rule_name'] = rule['name']
         # TODO record info about multiple alerts
-        body['alert_info'] = rule['alert'][0].get_info()
+        body['alert_info'] = rule['alerter_info'][0]
         body['alert_sent'] = alert_sent
         body['alert_time'] = alert_time
 
@@ -731,101 +920,203 @@ class ElastAlerter():
 
         if '@timestamp' not in body:
             body['@timestamp'] = ts_now()
-        if self.writeback_es:
-            try:
-                res = self.writeback_es.create(index=self.writeback_index,
-                                               doc_type=doc_type, body=body)
-                return res
-            except ElasticsearchException as e:
-                logging.exception("Error writing alert info to elasticsearch: %s" % (e))
-                self.writeback_es = None
+        try:
+            res = self.writeback_es.create(index=self.writeback_index,
+                                           doc_type=doc_type, body=body)
+            return res
+        except ElasticsearchException as e:
+            logging.exception("Error writing alert info to elasticsearch: %s" % (e))
         return None
 
+    def buffer_writeback(self, doc_type, body):
+        """ Queues a document to be written to the writeback index by the next flush_writeback.
+        The buffer is flushed automatically once it holds writeback_flush_size documents. """
+        if self.debug:
+            logging.info("Skipping writing to ES: %s" % (body))
+            return
+
+        if '@timestamp' not in body:
+            body['@timestamp'] = ts_now()
+        with self.writeback_lock:
+            self.writeback_buffer.append((doc_type, body))
+            buffer_full = len(self.writeback_buffer) >= self.writeback_flush_size
+        if buffer_full:
+            self.flush_writeback()
+
+    def get_cycle_now(self):
+        """ Returns the time at which the current query cycle started, or the actual
+        current time when called outside of start(). """
+        return self.cycle_now or dt_now()
+
+    def start_writeback_flusher(self):
+        """ Starts a daemon thread which flushes the writeback buffer every writeback_flush_interval. """
+        if self.writeback_flusher:
+            return
+        self.writeback_flusher = threading.Thread(target=self.run_writeback_flusher, name='writeback_flusher')
+        self.writeback_flusher.daemon = True
+        self.writeback_flusher.start()
+
+    def run_writeback_flusher(self):
+        interval = self.writeback_flush_interval.total_seconds()
+        wait = threading.Event().wait
+        while True:
+            wait(interval)
+            try:
+                self.flush_writeback()
+            except Exception as e:
+                logging.exception("Error flushing writeback buffer: %s" % (e))
+
+    def flush_writeback(self):
+        """ Writes all buffered documents to the writeback index with a single bulk request.
+        Returns True on success. """
+        with self.writeback_lock:
+            docs, self.writeback_buffer = self.writeback_buffer, []
+        if not docs:
+            return None
+        return self.writeback_bulk([(doc_type, body, None) for doc_type, body in docs])
+
+    def writeback_bulk(self, docs):
+        """ Writes a list of (doc_type, body, doc_id) documents to the writeback index with a
+        single bulk request. If doc_id is None, Elasticsearch will assign one. Returns True on success. """
+        if self.debug:
+            logging.info("Skipping writing to ES: %s" % ([body for doc_type, body, doc_id in docs]))
+            return None
+
+        bulk_body = []
+        for doc_type, body, doc_id in docs:
+            if '@timestamp' not in body:
+                body['@timestamp'] = ts_now()
+            action = {'_index': self.writeback_index, '_type': doc_type}
+            if doc_id:
+                action['_id'] = doc_id
+            bulk_body.append({'create': action})
+            bulk_body.append(body)
+
+        try:
+            res = self.writeback_es.bulk(body=bulk_body)
+        except ElasticsearchException as e:
+            logging.exception("Error writing alert info to elasticsearch: %s" % (e))
+            return False
+        if res.get('errors'):
+            logging.error("Failed to write some alert info to elasticsearch: %s" % (
+                [item for item in res['items'] if item['create'].get('error')]))
+            return False
+        return True
+
+    def delete_writeback_bulk(self, doc_type, ids):
+        """ Deletes several documents from the writeback index with a single bulk request.
+        Returns True on success. """
+        if not ids:
+            return True
+        bulk_body = [{'delete': {'_index': self.writeback_index, '_type': doc_type, '_id': _id}} for _id in ids]
+        try:
+            res = self.writeback_es.bulk(body=bulk_body)
+        except ElasticsearchException as e:
+            logging.exception("Error deleting documents from elasticsearch: %s" % (e))
+            return False
+        if res.get('errors'):
+            logging.error("Failed to delete some documents from elasticsearch: %s" % (
+                [item for item in res['items'] if item['delete'].get('error')]))
+            return False
+        return True
+
     def find_recent_pending_alerts(self, time_limit):
         """ Queries writeback_es to find alerts that did not send
         and are newer than time_limit """
-        query = {'query': {'query_string': {'query': 'alert_sent:false'}},
-                 'filter': {'range': {'alert_time': {'from': ts_add(ts_now(), -time_limit),
-                                                     'to': ts_now()}}}}
-        if self.writeback_es:
-            try:
-                res = self.writeback_es.search(index=self.writeback_index,
-                                               doc_type='elastalert',
-                                               body=query,
-                                               size=1000)
-                if res['hits']['hits']:
-                    return res['hits']['hits']
-            except:
-                pass
-        return []
+        now = self.get_cycle_now()
+        query = self.pending_alerts_template.replace('__STARTTIME__', dt_to_ts(now - time_limit)).replace('__ENDTIME__', dt_to_ts(now))
+        try:
+            res = self.writeback_es.search(index=self.writeback_index,
+                                           doc_type='elastalert',
+                                           body=query,
+                                           size=1000,
+                                           _source_include=['rule_name', 'alert_time', 'match_body', 'aggregate_id'])
+        except ElasticsearchException as e:
+            self.handle_error("Error querying for pending alerts: %s" % (e))
+            return []
+        return res['hits']['hits']
 
     def send_pending_alerts(self):
+        now = self.get_cycle_now()
         pending_alerts = self.find_recent_pending_alerts(self.alert_time_limit)
+        due_alerts = []
+        due_ids = []
         for alert in pending_alerts:
             _id = alert['_id']
             alert = alert['_source']
-            try:
-                rule_name = alert.pop('rule_name')
-                alert_time = alert.pop('alert_time')
-                match_body = alert.pop('match_body')
-            except KeyError:
+            if 'rule_name' not in alert or 'alert_time' not in alert or 'match_body' not in alert:
                 # Malformed alert, drop it
                 continue
 
-            agg_id = alert.get('aggregate_id', None)
-            if agg_id:
+            if alert.get('aggregate_id'):
                 # Aggregated alerts will be taken care of by get_aggregated_matches
                 continue
 
             # Find original rule
-            for rule in self.rules:
-                if rule['name'] == rule_name:
-                    break
-            else:
+            rule = self.rules_by_name.get(alert['rule_name'])
+            if rule is None:
                 # Original rule is missing, drop alert
                 continue
 
             # Retry the alert unless it's a future alert
-            if ts_delta(alert_time, ts_now()) > datetime.timedelta(0):
-                aggregated_matches = self.get_aggregated_matches(_id)
-                if aggregated_matches:
-                    matches = [match_body] + [agg_match['match_body'] for agg_match in aggregated_matches]
-                    self.alert(matches, rule, alert_time=alert_time)
-                    rule['current_aggregate_id'] = None
-                else:
-                    self.alert([match_body], rule, alert_time=alert_time)
+            alert_time = alert['alert_time']
+            if ts_to_dt(alert_time) < now:
+                due_alerts.append((_id, rule, alert_time, alert['match_body']))
+                due_ids.append(_id)
+
+        # Fetch the aggregated matches of every due alert at once
+        aggregated_matches = self.get_aggregated_matches(due_ids)
+        for _id, rule, alert_time, match_body in due_alerts:
+            if aggregated_matches[_id]:
+                matches = [match_body] + [agg_match['match_body'] for agg_match in aggregated_matches[_id]]
+                self.alert(matches, rule, alert_time=alert_time)
+                rule['current_aggregate_id'] = None
+            else:
+                self.alert([match_body], rule, alert_time=alert_time)
 
-                # Delete it from the index
-                try:
-                    self.writeback_es.delete(index=self.writeback_index,
-                                             doc_type='elastalert',
-                                             id=_id)
-                except:
-                    self.handle_error("Failed to delete alert %s at %s" % (_id, alert_time))
+        # Delete them from the index
+        if not self.delete_writeback_bulk('elastalert', due_ids):
+            self.handle_error("Failed to delete pending alerts", {'ids': due_ids})
 
         # Send in memory aggregated alerts
         for rule in self.rules:
             if rule['agg_matches']:
-                if ts_delta(rule['aggregate_alert_time'], ts_now()) > datetime.timedelta(0):
+                if rule['aggregate_alert_time'] < now:
                     self.alert(rule['agg_matches'], rule)
                     rule['agg_matches'] = []
 
-    def get_aggregated_matches(self, _id):
-        """ Removes and returns all matches from writeback_es that have aggregate_id == _id """
-        query = {'query': {'query_string': {'query': 'aggregate_id:%s' % (_id)}}}
-        matches = []
-        if self.writeback_es:
-            try:
-                res = self.writeback_es.search(index=self.writeback_index,
-                                               doc_type='elastalert',
-                                               body=query)
-                for match in res['hits']['hits']:
-                    matches.append(match['_source'])
-                    self.writeback_es.delete(index=self.writeback_index,
-                                             doc_type='elastalert',
-                                             id=match['_id'])
-            except (KeyError, ElasticsearchException) as e:
-                self.handle_error("Error fetching aggregated matches: %s" % (e), {'id': _id})
+    def get_aggregated_matches(self, ids):
+        """ Removes and returns all matches from writeback_es that have an aggregate_id in ids,
+        using a single msearch. Returns a dictionary mapping each _id to its list of matches. """
+        matches = dict((_id, []) for _id in ids)
+        if not ids:
+            return matches
+
+        body = []
+        for _id in ids:
+            body.append({'index': self.writeback_index, 'type': 'elastalert'})
+            # Indices created before aggregate_id was mapped as not_analyzed have it analyzed,
+            # so match the whole id as a phrase rather than with a term query
+            body.append({'query': {'match_phrase': {'aggregate_id': _id}},
+                         '_source': ['match_body']})
+
+        try:
+            res = self.writeback_es.msearch(body=body)
+        except ElasticsearchException as e:
+            self.handle_error("Error fetching aggregated matches: %s" % (e), {'ids': ids})
+            return matches
+
+        match_ids = []
+        for _id, response in zip(ids, res['responses']):
+            if 'error' in response:
+                self.handle_error("Error fetching aggregated matches: %s" % (response['error']), {'id': _id})
+                continue
+            for match in response['hits']['hits']:
+                matches[_id].append(match['_source'])
+                match_ids.append(match['_id'])
+
+        if not self.delete_writeback_bulk('elastalert', match_ids):
+            self.handle_error("Error deleting aggregated matches", {'ids': ids})
         return matches
 
     def add_aggregated_alert(self, match, rule):
@@ -842,7 +1133,7 @@ class ElastAlerter():
             agg_id = rule['current_aggregate_id']
             logging.info('Adding alert for %s to aggregation, next alert at %s' % (rule['name'], alert_time))
 
-        alert_body = self.get_alert_body(match, rule, False, alert_time)
+        alert_body = self.get_alert_body(match, rule, False, dt_to_ts(alert_time))
         if agg_id:
             alert_body['aggregate_id'] = agg_id
         res = self.writeback('elastalert', alert_body)
@@ -874,7 +1165,8 @@ class ElastAlerter():
             logging.error('%s is not a valid time period' % (self.args.silence))
             exit(1)
 
-        if not self.set_realert(rule_name, silence_ts):
+        self.set_realert(rule_name, silence_ts)
+        if not self.flush_writeback():
             logging.error('Failed to save silence command to elasticsearch')
             exit(1)
 
@@ -885,45 +1177,124 @@ class ElastAlerter():
         body = {'rule_name': rule_name,
                 '@timestamp': ts_now(),
                 'until': timestamp}
-        self.silence_cache[rule_name] = timestamp
-        return self.writeback('silence', body)
-
-    def is_silenced(self, rule_name):
-        """ Checks if rule_name is currently silenced. Returns false on exception. """
-        if rule_name in self.silence_cache:
-            if ts_delta(self.silence_cache[rule_name], ts_now()) < datetime.timedelta(0):
-                return True
-            else:
-                self.silence_cache.pop(rule_name)
-                return False
+        self.silence_cache[rule_name] = (ts_to_dt(timestamp), self.get_cycle_now())
+        self.buffer_writeback('silence', body)
+
+    def fetch_silences(self, rule_names):
+        """ Queries elasticsearch for the silences of several rule names with a single msearch
+        and caches the active ones. Returns True if every name's silence status is now known. """
+        rule_names = [rule_name for rule_name in rule_names if self.get_cached_silence(rule_name) is None]
+        if not rule_names:
+            return True
+
+        body = []
+        for rule_name in rule_names:
+            body.append({'index': self.writeback_index, 'type': 'silence'})
+            body.append({'filter': {'term': {'rule_name': rule_name}},
+                         'sort': {'until': {'order': 'desc'}},
+                         'size': 1,
+                         '_source': ['until']})
+
+        try:
+            res = self.writeback_es.msearch(body=body)
+        except ElasticsearchException as e:
+            self.handle_error("Error while querying for alert silence status: %s" % (e), {'rules': rule_names})
+            return False
+
+        fetched = True
+        for rule_name, response in zip(rule_names, res['responses']):
+            if 'error' in response:
+                fetched = False
+                continue
+            until_ts = None
+            if response['hits']['hits']:
+                until_ts = response['hits']['hits'][0]['_source']['until']
+            self.cache_silence(rule_name, until_ts)
+        return fetched
+
+    def get_cached_silence(self, rule_name):
+        """ Returns whether rule_name is silenced according to silence_cache, or None if it has to be
+        looked up. Active silences are cached until they expire, the absence of one for silence_cache_ttl. """
+        cached = self.silence_cache.get(rule_name)
+        if cached is None:
+            return None
+        until, cached_at = cached
+        now = self.get_cycle_now()
+        if until is not None and until > now:
+            return True
+        if until is None and now - cached_at < self.silence_cache_ttl:
+            return False
+        self.silence_cache.pop(rule_name, None)
+        return None
+
+    def expire_silence_cache(self):
+        """ Drops the silence_cache entries that get_cached_silence would no longer use. Without this, a rule
+        with a query_key would keep an entry for every value that has ever matched. """
+        now = self.get_cycle_now()
+        expired = []
+        for rule_name, (until, cached_at) in self.silence_cache.iteritems():
+            if until is not None and until > now:
+                continue
+            if until is None and now - cached_at < self.silence_cache_ttl:
+                continue
+            expired.append(rule_name)
+        for rule_name in expired:
+            del self.silence_cache[rule_name]
+
+    def cache_silence(self, rule_name, until_ts):
+        """ Caches the latest silence for rule_name, or None if it has none. Returns True if it is active. """
+        now = self.get_cycle_now()
+        until = ts_to_dt(until_ts) if until_ts is not None else None
+        if until is not None and until <= now:
+            until = None
+        self.silence_cache[rule_name] = (until, now)
+        return until is not None
+
+    def is_silenced(self, rule_name, cache_only=False):
+        """ Checks if rule_name is currently silenced. Returns false on exception.
+        If cache_only is set, silence_cache is already known to be up to date (see fetch_silences)
+        and elasticsearch is not queried. """
+        silenced = self.get_cached_silence(rule_name)
+        if silenced is not None:
+            return silenced
+
+        if cache_only:
+            return False
 
         query = {'filter': {'term': {'rule_name': rule_name}},
                  'sort': {'until': {'order': 'desc'}}}
 
-        if self.writeback_es:
-            try:
-                res = self.writeback_es.search(index=self.writeback_index, doc_type='silence',
-                                               size=1, body=query, _source_include=['until'])
-            except ElasticsearchException as e:
-                self.handle_error("Error while querying for alert silence status: %s" % (e), {'rule': rule_name})
-
-                return False
+        try:
+            res = self.writeback_es.search(index=self.writeback_index, doc_type='silence',
+                                           size=1, body=query, _source_include=['until'])
+        except ElasticsearchException as e:
+            self.handle_error("Error while querying for alert silence status: %s" % (e), {'rule': rule_name})
+            return False
 
-            if res['hits']['hits']:
-                until_ts = res['hits']['hits'][0]['_source']['until']
-                if ts_delta(until_ts, ts_now()) < datetime.timedelta(0):
-                    self.silence_cache[rule_name] = until_ts
-                    return True
-        return False
+        until_ts = None
+        if res['hits']['hits']:
+            until_ts = res['hits']['hits'][0]['_source']['until']
+        return self.cache_silence(rule_name, until_ts)
+
+    def get_traceback(self):
+        """ Returns the lines of the traceback of the exception being handled, or None if there is none.
+        The lines are kept per thread, since one exception is often reported once for every match it affects.
+        Only the exception itself is kept to recognise it, which on Python 2 doesn't reference its traceback. """
+        exc_value = sys.exc_info()[1]
+        if exc_value is None:
+            return None
+        if self.thread_data.last_exception is not exc_value:
+            self.thread_data.last_exception = exc_value
+            self.thread_data.last_traceback_lines = traceback.format_exc().strip().split('\n')
+        return self.thread_data.last_traceback_lines
 
     def handle_error(self, message, data=None):
         ''' Logs message at error level and writes message, data and traceback to Elasticsearch. '''
-        if not self.writeback_es:
-            self.writeback_es = Elasticsearch(host=self.es_host, port=self.es_port)
         logging.error(message)
         body = {'message': message}
-        tb = traceback.format_exc()
-        body['traceback'] = tb.strip().split('\n')
+        tb = self.get_traceback()
+        if tb:
+            body['traceback'] = tb
         if data:
             body['data'] = data
         self.writeback('elastalert_error', body)
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 from .util import pretty_ts
+from .util import ts_to_dt
 from datetime import datetime
 from pytz import timezone
+from pytz import utc
+
+
+LOCAL_TZ_NAME = 'Asia/Ho_Chi_Minh'
+LOCAL_TZ = timezone(LOCAL_TZ_NAME)
 
 
 class BaseEnhancement(object):
@@ -23,20 +29,26 @@ class TimeEnhancement(BaseEnhancement):
         # Convert UTC to desired timezone
         utc_time = match.get('createdDate')
         if utc_time:
-            local_time = self.convert_utc_to_local(utc_time, 'Asia/Ho_Chi_Minh')
+            local_time = self.convert_utc_to_local(utc_time, LOCAL_TZ_NAME)
             match['createdDate'] = local_time
 
-    def convert_utc_to_local(self, utc_dt_str, local_tz='Asia/Ho_Chi_Minh'):
-        try:
-            utc_dt = datetime.strptime(utc_dt_str, '%Y-%m-%dT%H:%M:%S.%f%z')
-        except ValueError:
-            try:
+    def convert_utc_to_local(self, utc_dt_str, local_tz=LOCAL_TZ_NAME):
+        # Pick the format from the shape of the string instead of trying each one
+        if utc_dt_str.endswith('Z'):
+            if '.' in utc_dt_str:
                 utc_dt = datetime.strptime(utc_dt_str, '%Y-%m-%dT%H:%M:%S.%fZ')
-            except ValueError:
+            else:
                 utc_dt = datetime.strptime(utc_dt_str, '%Y-%m-%dT%H:%M:%SZ')
-        
+            utc_dt = utc_dt.replace(tzinfo=utc)
+        else:
+            # Explicit UTC offset, eg. +00:00
+            utc_dt = ts_to_dt(utc_dt_str)
+
         # Convert UTC datetime to local timezone
-        local_tz = timezone(local_tz)
+        if local_tz == LOCAL_TZ_NAME:
+            local_tz = LOCAL_TZ
+        else:
+            local_tz = timezone(local_tz)
         local_dt = utc_dt.astimezone(local_tz)
         return local_dt.isoformat()
 
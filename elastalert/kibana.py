@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import copy
+
 from util import EAException
 
 
@@ -167,6 +169,14 @@ dashboard_temp = {'editable': True,
                   u'title': u'ElastAlert Alert Dashboard'}
 
 
+def copy_dashboard(dashboard):
+    """ Returns a copy of dashboard which can be passed to set_time, add_filter and set_name.
+    Only the services are deep copied, the other subtrees are shared with dashboard. """
+    dashboard_copy = dict(dashboard)
+    dashboard_copy['services'] = copy.deepcopy(dashboard['services'])
+    return dashboard_copy
+
+
 def set_time(dashboard, start, end):
     dashboard['services']['filter']['list']['0']['from'] = start
     dashboard['services']['filter']['list']['0']['to'] = end
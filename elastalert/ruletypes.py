@@ -210,11 +210,12 @@ class FrequencyRule(RuleType):
 
     def garbage_collect(self, timestamp):
         """ Remove all occurrence data that is beyond the timeframe away """
-        stale_keys = []
-        for key, window in self.occurrences.iteritems():
-            if ts_delta(window.data[-1][0][self.ts_field], timestamp) > self.rules['timeframe']:
-                stale_keys.append(key)
-        map(self.occurrences.pop, stale_keys)
+        timestamp = ts_to_dt(timestamp)
+        timeframe = self.rules['timeframe']
+        stale_keys = [key for key, window in self.occurrences.iteritems()
+                      if timestamp - ts_to_dt(window.data[-1][0][self.ts_field]) > timeframe]
+        for key in stale_keys:
+            del self.occurrences[key]
 
     def add_match(self, event):
         """ Adds time of first event in timeframe and the number of events """
@@ -4,6 +4,12 @@ import logging
 
 import dateutil.parser
 import dateutil.tz
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 
 def lookup_es_key(lookup_dict, term):
@@ -81,8 +87,12 @@ def dt_to_ts(dt):
     return ts.replace('000+00:00', 'Z')
 
 
+def dt_now():
+    return datetime.datetime.utcnow().replace(tzinfo=dateutil.tz.tzutc())
+
+
 def ts_now():
-    return datetime.datetime.utcnow().replace(tzinfo=dateutil.tz.tzutc()).isoformat()
+    return dt_now().isoformat()
 
 
 def inc_ts(timestamp, milliseconds=1):
@@ -145,5 +155,18 @@ def format_index(index, starttime, endtime):
     return ','.join(indexes)
 
 
+class FastJSONSerializer(JSONSerializer):
+    """ Elasticsearch serializer which parses responses with ujson when it is installed.
+    Requests are still encoded by the standard JSONSerializer, because ujson writes
+    datetimes as epoch integers instead of ISO8601 strings. """
+    def loads(self, s):
+        if ujson:
+            try:
+                return ujson.loads(s, precise_float=True)
+            except ValueError:
+                pass
+        return super(FastJSONSerializer, self).loads(s)
+
+
 class EAException(Exception):
     pass